@@ -1,30 +1,37 @@
 import sys
 import os
 import json
+import math
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import base64
 import sqlite3
+import threading
+from collections import deque
+from functools import lru_cache
+from types import MappingProxyType
 from PyQt5.QtCore import QThread, pyqtSignal
 
-# Third-party imports
-from dotenv import load_dotenv
-import requests
+# Third-party imports (requests, dotenv and keyring are imported lazily on first use)
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library encoder
+    orjson = None
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
-    QTextEdit,
+    QPlainTextEdit,
     QPushButton,
     QLabel,
-    QScrollArea,
-    QSizePolicy,
+    QListView,
+    QStyledItemDelegate,
+    QMenu,
     QInputDialog,
     QLineEdit,
-    QFrame,
     QComboBox,
     QDialog,
     QMessageBox,
@@ -33,156 +40,449 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import (
     Qt,
     QSize,
+    QPoint,
+    QPointF,
+    QRect,
     QTimer,
-    QPropertyAnimation,
-    QEasingCurve,
+    QAbstractListModel,
+    QModelIndex,
+    QPersistentModelIndex,
     QBuffer,
     QByteArray,
 )
-from PyQt5.QtGui import QFont, QPalette, QColor, QResizeEvent, QIcon, QPixmap, QImage
+from PyQt5.QtGui import (
+    QFont,
+    QFontMetrics,
+    QPainter,
+    QTextLayout,
+    QTextOption,
+    QPalette,
+    QColor,
+    QIcon,
+    QPixmap,
+    QPixmapCache,
+    QImage,
+)
+
+
+# Read-only: shared by every window and never modified
+_PERSONALITY_PROMPTS = MappingProxyType(
+    {
+        "Professional": "You are a professional assistant. Provide clear, concise, and accurate responses in a formal tone.",
+        "Friendly": "You are a friendly and approachable assistant. Use a casual, warm tone and engage in natural conversation.",
+        "Technical": "You are a technical expert. Provide detailed technical explanations and use industry-standard terminology.",
+        "Creative": "You are a creative assistant. Think outside the box and provide innovative solutions with an imaginative flair.",
+    }
+)
 
-load_dotenv()
+
+# Window stylesheet for both themes, applied once. Rules are keyed on the
+# window's darkTheme property and scoped by object name so they only reach the
+# chat view and the input field.
+_THEME_QSS = """
+    QPlainTextEdit#input_field {
+        border: 1px solid #ccc;
+        border-radius: 20px;
+        padding: 10px;
+        background-color: white;
+        color: black;
+    }
+    QMainWindow[darkTheme="true"] QPlainTextEdit#input_field {
+        border: 1px solid #666;
+        background-color: #383838;
+        color: white;
+    }
+    QListView#chat_view {
+        border: none;
+        background-color: transparent;
+    }
+    QMainWindow[darkTheme="true"] QListView#chat_view {
+        background-color: #2c2c2c;
+    }
+    QListView#chat_view QScrollBar:vertical {
+        border: none;
+        background-color: #f0f0f0;
+        width: 10px;
+        margin: 0px;
+    }
+    QMainWindow[darkTheme="true"] QListView#chat_view QScrollBar:vertical {
+        background-color: #404040;
+    }
+    QListView#chat_view QScrollBar::handle:vertical {
+        background-color: #c1c1c1;
+        min-height: 30px;
+        border-radius: 5px;
+    }
+    QMainWindow[darkTheme="true"] QListView#chat_view QScrollBar::handle:vertical {
+        background-color: #666;
+    }
+    QListView#chat_view QScrollBar::handle:vertical:hover {
+        background-color: #a8a8a8;
+    }
+    QMainWindow[darkTheme="true"] QListView#chat_view
+    QScrollBar::handle:vertical:hover {
+        background-color: #808080;
+    }
+"""
+
+
+def json_dumps(obj) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # Match orjson's compact output so the upload carries no padding
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# Light and dark application palettes, built on first use
+_PALETTES: Dict[bool, QPalette] = {}
 
 
 class APIKeyManager:
+    # Store in user's home directory to ensure write permissions
+    _CACHE_FILE = os.path.join(str(Path.home()), ".chatbotqt", "api_key.cache")
+    # Preferred storage: the OS keychain, when the keyring package is installed
+    _KEYRING_SERVICE = "chatbotqt"
+    _KEYRING_USERNAME = "openrouter"
+    # keyring module, imported on first use; False when missing or unusable
+    _keyring = None
+
     @staticmethod
     def validate_api_key(key: str) -> bool:
         """Basic validation of API key format."""
         return bool(key and len(key.strip()) >= 10)
 
-    @staticmethod
-    def get_cache_file():
-        # Store in user's home directory to ensure write permissions
-        home = str(Path.home())
-        cache_dir = os.path.join(home, ".chatbotqt")
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        return os.path.join(cache_dir, "api_key.cache")
-
-    @staticmethod
-    def get_cached_key():
-        try:
-            cache_file = APIKeyManager.get_cache_file()
-            if os.path.exists(cache_file):
-                with open(cache_file, "r") as f:
-                    return f.read().strip()
-        except Exception as e:
-            print(f"Error reading cache: {e}")
-        return None
-
-    @staticmethod
-    def save_key(key):
-        if not APIKeyManager.validate_api_key(key):
+    @classmethod
+    def get_cache_file(cls):
+        return cls._CACHE_FILE
+
+    @classmethod
+    def _get_keyring(cls):
+        """Return the keyring module, or None when it can't be used."""
+        if cls._keyring is None:
+            try:
+                import keyring
+                import keyring.errors
+            except ImportError:  # Optional: fall back to the plain-text cache file
+                keyring = False
+            cls._keyring = keyring
+        return cls._keyring or None
+
+    @classmethod
+    def get_cached_key(cls):
+        keyring = cls._get_keyring()
+        if keyring is not None:
+            try:
+                key = keyring.get_password(cls._KEYRING_SERVICE, cls._KEYRING_USERNAME)
+                if key:
+                    return key
+            except keyring.errors.NoKeyringError:
+                # No backend configured; use the cache file from now on
+                cls._keyring = False
+            except keyring.errors.KeyringError:
+                pass
+            except Exception as e:
+                print(f"Error reading keyring: {e}")
+
+        key = cls._read_cache_file()
+        # One-shot migration of a key left in the old plain-text cache
+        if key and cls._save_to_keyring(key):
+            cls._remove_cache_file()
+        return key
+
+    @classmethod
+    def save_key(cls, key):
+        if not cls.validate_api_key(key):
             return False
 
+        if cls._save_to_keyring(key):
+            cls._remove_cache_file()
+            return True
+
         try:
-            cache_file = APIKeyManager.get_cache_file()
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-            with open(cache_file, "w") as f:
+            # Only the write path needs the directory to exist
+            os.makedirs(os.path.dirname(cls._CACHE_FILE), exist_ok=True)
+            with open(cls._CACHE_FILE, "w") as f:
                 f.write(key)
-            print(f"API key saved to: {cache_file}")
+            print(f"API key saved to: {cls._CACHE_FILE}")
             return True
         except Exception as e:
             print(f"Error saving cache: {e}")
             return False
 
-    @staticmethod
-    def clear_key():
+    @classmethod
+    def clear_key(cls):
+        cleared = False
+        keyring = cls._get_keyring()
+        if keyring is not None:
+            try:
+                keyring.delete_password(cls._KEYRING_SERVICE, cls._KEYRING_USERNAME)
+                cleared = True
+            except keyring.errors.NoKeyringError:
+                cls._keyring = False
+            except Exception:
+                # Nothing stored, or no usable keyring backend
+                pass
+        return cls._remove_cache_file() or cleared
+
+    @classmethod
+    def _save_to_keyring(cls, key):
+        keyring = cls._get_keyring()
+        if keyring is None:
+            return False
+        try:
+            keyring.set_password(cls._KEYRING_SERVICE, cls._KEYRING_USERNAME, key)
+            return True
+        except keyring.errors.NoKeyringError:
+            cls._keyring = False
+        except keyring.errors.KeyringError:
+            pass
+        except Exception as e:
+            print(f"Error saving to keyring: {e}")
+        return False
+
+    @classmethod
+    def _read_cache_file(cls):
+        try:
+            with open(cls._CACHE_FILE, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading cache: {e}")
+        return None
+
+    @classmethod
+    def _remove_cache_file(cls):
         try:
-            cache_file = APIKeyManager.get_cache_file()
-            if os.path.exists(cache_file):
-                os.remove(cache_file)
-                return True
+            os.remove(cls._CACHE_FILE)
+            return True
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Error clearing cache: {e}")
         return False
 
 
-class MessageBubble(QWidget):
-    def __init__(self, message, is_user=True, parent=None, image_path=None):
+class ChatModel(QAbstractListModel):
+    """List model holding the chat messages shown in the chat view."""
+
+    IsUserRole = Qt.UserRole + 1
+    TimestampRole = Qt.UserRole + 2
+    PixmapRole = Qt.UserRole + 3
+
+    # Messages in the same minute share one "%H:%M" string
+    _last_minute = None
+    _last_timestamp = ""
+
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Minimum)
-        # Store whether this is a user message
-        self.setProperty("is_user", is_user)
-        layout = QHBoxLayout()
-        layout.setContentsMargins(10, 5, 10, 5)
-
-        # Create message container
-        container = QFrame()
-        container_layout = QVBoxLayout(container)
-        container_layout.setContentsMargins(10, 10, 10, 5)
-
-        # Create message bubble
-        self.bubble = QTextEdit()
-        self.bubble.setReadOnly(True)
-        self.bubble.setFont(QFont("Segoe UI", 10))
-        self.bubble.setText(message)
-        self.bubble.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Minimum)
-        self.bubble.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-
-        # Add typing animation for bot messages
-        self.opacity = 0.0 if not is_user else 1.0
-        self.animation = QPropertyAnimation(self, b"windowOpacity")
-        self.animation.setDuration(200)
-        self.animation.setStartValue(0.0)
-        self.animation.setEndValue(1.0)
-        self.animation.setEasingCurve(QEasingCurve.InOutQuad)
-
-        # WhatsApp colors (constant regardless of theme)
-        user_bg = "#E1FFC7"  # WhatsApp light green
-        user_text = "#000000"  # Black text
-        bot_bg = "#FFFFFF"  # White background
-        bot_text = "#000000"  # Black text
-
-        self.bubble.setStyleSheet(f"""
-            QTextEdit {{
-                background-color: {user_bg if is_user else bot_bg};
-                color: {user_text if is_user else bot_text};
-                border-radius: 15px;
-                padding: 8px;
-                border: none;
-            }}
-        """)
+        # Each entry is [text, is_user, timestamp, pixmap]
+        self._messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, is_user, timestamp, pixmap = self._messages[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == self.IsUserRole:
+            return is_user
+        if role == self.TimestampRole:
+            return timestamp
+        if role == self.PixmapRole:
+            return pixmap
+        return None
 
-        # Handle image if provided
-        if image_path:
-            image_label = QLabel()
-            pixmap = QPixmap(image_path)
-            scaled_pixmap = pixmap.scaled(
-                300, 300, Qt.KeepAspectRatio, Qt.SmoothTransformation
-            )
-            image_label.setPixmap(scaled_pixmap)
-            container_layout.addWidget(image_label)
+    @classmethod
+    def current_timestamp(cls):
+        now = datetime.now()
+        minute = (now.hour, now.minute)
+        if minute != cls._last_minute:
+            cls._last_minute = minute
+            cls._last_timestamp = f"{now.hour:02d}:{now.minute:02d}"
+        return cls._last_timestamp
+
+    def append_message(self, text, is_user, timestamp, pixmap=None):
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._messages.append([text, is_user, timestamp, pixmap])
+        self.endInsertRows()
+        return self.index(row)
+
+    def append_messages(self, messages):
+        """Append (text, is_user, timestamp) tuples as a single row insertion."""
+        if not messages:
+            return
+        first = len(self._messages)
+        self.beginInsertRows(QModelIndex(), first, first + len(messages) - 1)
+        self._messages.extend(
+            [text, is_user, timestamp, None] for text, is_user, timestamp in messages
+        )
+        self.endInsertRows()
+
+    def set_message_text(self, row, text):
+        self._messages[row][0] = text
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+
+class BubbleDelegate(QStyledItemDelegate):
+    """Paints chat messages as WhatsApp-style bubbles.
+
+    Only rows inside the viewport are painted, so the cost of a long
+    conversation no longer grows with one widget tree per message.
+    """
+
+    MARGIN_H = 10  # Gap between bubble and view edge
+    MARGIN_V = 5  # Gap between consecutive rows
+    PADDING = 8  # Gap between bubble edge and text
+    RADIUS = 15
+    MIN_WIDTH = 50
+    MAX_WIDTH_RATIO = 0.7
+    WIDTH_STEP = 16  # View widths are bucketed so small resizes reuse layouts
+
+    # (background, text) colors keyed by dark theme, built once for all rows
+    USER_COLORS = {
+        False: (QColor("#DCF8C6"), QColor("#000000")),
+        True: (QColor("#128C7E"), QColor("#FFFFFF")),
+    }
+    BOT_COLORS = {
+        False: (QColor("#FFFFFF"), QColor("#000000")),
+        True: (QColor("#383838"), QColor("#FFFFFF")),
+    }
+    TIME_COLOR = QColor("#9E9595")  # WhatsApp timestamp color
 
-        # Set size policies for dynamic resizing
-        self.bubble.setMinimumWidth(50)
-        self.bubble.setMaximumWidth(
-            int(self.window().width() * 0.7) if self.window() else 500
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.dark = False
+        self.font = QFont("Segoe UI", 10)
+        self.time_font = QFont("Segoe UI")
+        self.time_font.setPixelSize(10)
+        # Reused for every row instead of being rebuilt per paint/sizeHint call
+        self.time_height = QFontMetrics(self.time_font).height()
+        self.text_option = QTextOption()
+        self.text_option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+        # row -> (text width, QTextLayout, bubble size); see _bubble_geometry
+        self._layout_cache = {}
+
+    def invalidate(self, top_left=None, bottom_right=None, roles=None):
+        """Drop cached layouts for the changed rows (all rows if none given)."""
+        if top_left is None:
+            self._layout_cache.clear()
+            return
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self._layout_cache.pop(row, None)
+
+    def _layout_text(self, text, width):
+        """Lay out text wrapped to width; return (QTextLayout, used size)."""
+        # QTextLayout only breaks lines on Unicode line separators
+        layout = QTextLayout(text.replace("\n", "\u2028"), self.font)
+        layout.setTextOption(self.text_option)
+        layout.beginLayout()
+        height = 0.0
+        used_width = 0.0
+        while True:
+            line = layout.createLine()
+            if not line.isValid():
+                break
+            line.setLineWidth(width)
+            line.setPosition(QPointF(0, height))
+            height += line.height()
+            used_width = max(used_width, line.naturalTextWidth())
+        layout.endLayout()
+        return layout, QSize(math.ceil(used_width), math.ceil(height))
+
+    def _bubble_geometry(self, index, view_width):
+        """Return (bubble size, text layout) for the message at index.
+
+        Layouts are cached per row and only rebuilt when the row's text
+        changes or the view width moves into another WIDTH_STEP bucket.
+        """
+        view_width -= view_width % self.WIDTH_STEP
+        max_text_width = max(
+            int(view_width * self.MAX_WIDTH_RATIO) - 2 * self.PADDING, self.MIN_WIDTH
         )
+        cached = self._layout_cache.get(index.row())
+        if cached and cached[0] == max_text_width:
+            return cached[2], cached[1]
 
-        container_layout.addWidget(self.bubble)
+        layout, text_size = self._layout_text(
+            index.data(Qt.DisplayRole), max_text_width
+        )
+        width = text_size.width()
+        height = text_size.height()
+        pixmap = index.data(ChatModel.PixmapRole)
+        if pixmap:
+            width = max(width, pixmap.width())
+            height += pixmap.height() + self.PADDING
+        width = max(width + 2 * self.PADDING, self.MIN_WIDTH)
+        bubble_size = QSize(width, height + 2 * self.PADDING)
+        self._layout_cache[index.row()] = (max_text_width, layout, bubble_size)
+        return bubble_size, layout
+
+    def _view_width(self, option):
+        view = option.widget
+        return view.viewport().width() if view else 500
+
+    def sizeHint(self, option, index):
+        bubble_size, _ = self._bubble_geometry(index, self._view_width(option))
+        return QSize(
+            bubble_size.width() + 2 * self.MARGIN_H,
+            bubble_size.height() + self.time_height + 2 * self.MARGIN_V,
+        )
 
-        # Add timestamp with WhatsApp style color
-        time = QLabel(datetime.now().strftime("%H:%M"))
-        time.setStyleSheet(
-            "color: #9E9595; font-size: 10px;"
-        )  # WhatsApp timestamp color
-        time.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
-        container_layout.addWidget(time, alignment=Qt.AlignRight)
+    def paint(self, painter, option, index):
+        is_user = index.data(ChatModel.IsUserRole)
+        rect = option.rect
+        bubble_size, text_layout = self._bubble_geometry(
+            index, self._view_width(option)
+        )
 
-        # Layout arrangement based on user/bot message
+        # User messages hug the right edge, bot messages the left one
         if is_user:
-            layout.addStretch()
-            layout.addWidget(container)
+            x = rect.right() - self.MARGIN_H - bubble_size.width()
         else:
-            layout.addWidget(container)
-            layout.addStretch()
+            x = rect.left() + self.MARGIN_H
+        bubble_rect = QRect(QPoint(x, rect.top() + self.MARGIN_V), bubble_size)
 
-        self.setLayout(layout)
+        background, foreground = (self.USER_COLORS if is_user else self.BOT_COLORS)[
+            self.dark
+        ]
 
-        if not is_user:
-            QTimer.singleShot(0, self.animation.start)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(background)
+        painter.drawRoundedRect(bubble_rect, self.RADIUS, self.RADIUS)
+
+        top = bubble_rect.top() + self.PADDING
+        pixmap = index.data(ChatModel.PixmapRole)
+        if pixmap:
+            painter.drawPixmap(bubble_rect.left() + self.PADDING, top, pixmap)
+            top += pixmap.height() + self.PADDING
+
+        painter.setPen(foreground)
+        text_layout.draw(painter, QPointF(bubble_rect.left() + self.PADDING, top))
+
+        # Timestamp, right-aligned under the bubble
+        painter.setPen(self.TIME_COLOR)
+        painter.setFont(self.time_font)
+        time_rect = QRect(
+            bubble_rect.left(),
+            bubble_rect.bottom(),
+            bubble_rect.width(),
+            self.time_height,
+        )
+        painter.drawText(
+            time_rect, Qt.AlignRight, index.data(ChatModel.TimestampRole)
+        )
+        painter.restore()
 
 
 class ChatSettings(QDialog):
@@ -259,57 +559,151 @@ class ApiWorker(QThread):
     def __new__(cls, *args, **kwargs):
         return super(ApiWorker, cls).__new__(cls)
 
-    finished = pyqtSignal(dict)
+    chunk_received = pyqtSignal(str)
+    finished = pyqtSignal(str)
     error = pyqtSignal(str)
+    unauthorized = pyqtSignal()
 
-    def __init__(self, api_key, model, messages):
+    def __init__(self, model, messages, session):
         super().__init__()
-        self.api_key = api_key
         self.model = model
         self.messages = messages
+        self.session = session
 
     def run(self):
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "HTTP-Referer": "https://github.com/Mustaffa96/ChatbotQT",
-                "X-Title": "ChatbotQT",
-                "Content-Type": "application/json",
-            }
-
             data = {
                 "model": self.model,
                 "messages": self.messages,
                 "temperature": 0.7,
                 "max_tokens": 500,
+                "stream": True,
             }
 
-            response = requests.post(
+            response = self.session.post(
                 "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=data,
+                data=json_dumps(data),
                 timeout=30,
+                stream=True,
             )
 
-            response_json = response.json()
-            if "error" in response_json:
-                self.error.emit(f"API Error: {response_json['error']}")
-            else:
-                self.finished.emit(response_json)
+            with response:
+                # Let the UI prompt for a new key instead of surfacing a raw error
+                if response.status_code == 401:
+                    self.unauthorized.emit()
+                    return
+
+                # Errors before the stream starts come back as a plain JSON body
+                if response.status_code != 200:
+                    response_json = json_loads(response.content)
+                    self.error.emit(f"API Error: {response_json.get('error')}")
+                    return
+
+                parts = []
+                for line in response.iter_lines():
+                    # Server-sent events: skip keep-alive comments and blank lines
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[len(b"data: "):]
+                    if payload == b"[DONE]":
+                        break
+
+                    chunk = json_loads(payload)
+                    if "error" in chunk:
+                        self.error.emit(f"API Error: {chunk['error']}")
+                        return
+
+                    choices = chunk.get("choices")
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        self.chunk_received.emit(delta)
+
+            # Don't leave (or save) an empty reply bubble
+            if not parts:
+                self.error.emit("API Error: Empty response from model")
+                return
+            self.finished.emit("".join(parts))
         except Exception as e:
             self.error.emit(f"Request Error: {str(e)}")
 
 
+class KeyCheckWorker(QThread):
+    """Checks the API key against OpenRouter's lightweight key endpoint."""
+
+    invalid = pyqtSignal()
+
+    def __init__(self, api_key):
+        super().__init__()
+        self.api_key = api_key
+
+    def run(self):
+        try:
+            # Imported here so loading requests stays off the UI thread
+            import requests
+
+            response = requests.get(
+                "https://openrouter.ai/api/v1/auth/key",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=5,
+            )
+            if response.status_code == 401:
+                self.invalid.emit()
+        except Exception as e:
+            # Network problems will surface on the first real request
+            print(f"Error checking API key: {e}")
+
+
+class KeyLoader(QThread):
+    """Reads the stored API key (keychain or cache file) off the UI thread."""
+
+    loaded = pyqtSignal(object)
+
+    def run(self):
+        self.loaded.emit(APIKeyManager.get_cached_key())
+
+
+class HistoryLoader(QThread):
+    """Opens the chat database and reads recent history off the UI thread."""
+
+    loaded = pyqtSignal(object, list)
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def run(self):
+        try:
+            db_manager = DatabaseManager()
+            rows = db_manager.get_recent_messages(self.limit)
+        except Exception as e:
+            # Chat still works, just without saved history
+            print(f"Error loading chat history: {e}")
+            db_manager, rows = None, []
+        self.loaded.emit(db_manager, rows)
+
+
 class DatabaseManager:
     def __init__(self):
         self.db_path = os.path.join(str(Path.home()), ".chatbotqt", "chat_history.db")
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # One connection for the app's lifetime, in autocommit mode. WAL with
+        # synchronous=NORMAL avoids an fsync of the whole database per insert.
+        self.conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        # The connection may be shared across threads; serialize access to it
+        self._lock = threading.Lock()
         self.init_db()
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        with self._lock:
+            self.conn.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     role TEXT NOT NULL,
@@ -317,27 +711,24 @@ class DatabaseManager:
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
-            conn.commit()
 
     def save_message(self, role: str, content: str):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        with self._lock:
+            self.conn.execute(
                 "INSERT INTO messages (role, content) VALUES (?, ?)", (role, content)
             )
-            conn.commit()
 
-    def get_recent_messages(self, limit: int) -> List[Dict[str, str]]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT role, content FROM messages ORDER BY timestamp DESC LIMIT ?",
+    def get_recent_messages(self, limit: int) -> List[Tuple[str, str, str]]:
+        """Return (role, content, "HH:MM") rows, newest first.
+
+        Timestamps are stored in UTC and formatted in local time by SQLite.
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT role, content, strftime('%H:%M', timestamp, 'localtime') "
+                "FROM messages ORDER BY id DESC LIMIT ?",
                 (limit,),
-            )
-            return [
-                {"role": role, "content": content}
-                for role, content in cursor.fetchall()
-            ]
+            ).fetchall()
 
 
 class ChatbotWindow(QMainWindow):
@@ -348,27 +739,35 @@ class ChatbotWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle("ChatbotQT")
         self.setMinimumSize(500, 600)
-        self.setProperty("darkTheme", False)
+        # The app starts in the dark theme
+        self.setProperty("darkTheme", True)
+        self.setStyleSheet(_THEME_QSS)
         
         # Set window icon
-        icon = QIcon(resource_path(os.path.join("public", "chatbot.png")))
-        self.setWindowIcon(icon)
+        self.setWindowIcon(load_icon(os.path.join("public", "chatbot.png")))
         
-        # Initialize API key
-        self.api_key = APIKeyManager.get_cached_key()
-        if not self.api_key:
-            self.request_api_key()
+        # Shared HTTP session, created on first send (see get_http_session)
+        self._http = None
+
+        # API key, read by load_api_key once the window is up
+        self.api_key = None
+        # Set while the API key dialog is open (see request_api_key)
+        self._prompting_key = False
 
         # Initialize model and context window
         self.model = "openai/gpt-3.5-turbo"  # Default model
         self.context_window = 10  # Default context window size
+        self.max_context_tokens = 6000  # Rough token budget for each request
         self.personality = "Professional"  # Default personality
 
-        # Initialize conversation history and message cache
-        self.db_manager = DatabaseManager()
-        recent_messages = self.db_manager.get_recent_messages(self.context_window)
-        self.conversation_history = recent_messages
-        self.message_cache = recent_messages
+        # Conversation history and message cache (oldest first). Saved history
+        # is added by load_history once the window is up.
+        self.db_manager = None
+        self._history_loaded = False
+        self.conversation_history = [
+            {"role": "system", "content": self.get_personality_prompt()}
+        ]
+        self.message_cache = deque(maxlen=self.context_window)
 
         # Main layout
         layout = QVBoxLayout()
@@ -400,9 +799,9 @@ class ChatbotWindow(QMainWindow):
         header_layout.addStretch()
 
         # Settings button with round borders
-        settings_button = QPushButton("⚙️")
-        settings_button.setFixedSize(40, 40)
-        settings_button.setStyleSheet("""
+        self.settings_button = QPushButton("⚙️")
+        self.settings_button.setFixedSize(40, 40)
+        self.settings_button.setStyleSheet("""
             QPushButton {
                 border: 2px solid #ccc;
                 border-radius: 20px;
@@ -413,65 +812,48 @@ class ChatbotWindow(QMainWindow):
                 background-color: #e0e0e0;
             }
         """)
-        settings_button.clicked.connect(self.show_settings)
-        header_layout.addWidget(settings_button)
+        self.settings_button.clicked.connect(self.show_settings)
+        header_layout.addWidget(self.settings_button)
 
         layout.addLayout(header_layout)
 
-        # Create chat area with WhatsApp-like styling
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.scroll_area.setStyleSheet("""
-            QScrollArea {
-                border: none;
-                background-color: transparent;
-            }
-            QScrollBar:vertical {
-                border: none;
-                background-color: #f0f0f0;
-                width: 10px;
-                margin: 0px;
-            }
-            QScrollBar::handle:vertical {
-                background-color: #c1c1c1;
-                min-height: 30px;
-                border-radius: 5px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #a8a8a8;
-            }
-        """)
-
-        chat_container = QWidget()
-        chat_container.setObjectName("chat_container")
-        self.chat_layout = QVBoxLayout(chat_container)
-        self.chat_layout.setAlignment(Qt.AlignTop)
-        self.chat_layout.setSpacing(10)
-        self.scroll_area.setWidget(chat_container)
+        # Create chat area with WhatsApp-like styling. The list view paints only
+        # the rows visible in the viewport, but with non-uniform row sizes a
+        # layout pass still asks the delegate for every row's sizeHint.
+        self.chat_model = ChatModel(self)
+        self.chat_delegate = BubbleDelegate(self)
+        self.chat_view = QListView()
+        self.chat_view.setModel(self.chat_model)
+        self.chat_view.setItemDelegate(self.chat_delegate)
+        self.chat_model.dataChanged.connect(self.chat_delegate.invalidate)
+        self.chat_model.modelReset.connect(self.chat_delegate.invalidate)
+        self.chat_view.setUniformItemSizes(False)
+        self.chat_view.setVerticalScrollMode(QListView.ScrollPerPixel)
+        # Bubble heights depend on the view width; with word wrap on, the view
+        # re-lays out its rows on resize behind its own delayed-layout timer
+        self.chat_view.setWordWrap(True)
+        self.chat_view.setSelectionMode(QListView.NoSelection)
+        self.chat_view.setFocusPolicy(Qt.NoFocus)
+        self.chat_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.chat_view.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        self.chat_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.chat_view.customContextMenuRequested.connect(self.show_message_menu)
+        self.chat_view.setObjectName("chat_view")
 
         # Create input area with modern styling
         input_container = QWidget()
         input_layout = QHBoxLayout(input_container)
         input_layout.setContentsMargins(10, 10, 10, 10)
 
-        self.input_field = QTextEdit()
+        self.input_field = QPlainTextEdit()
         self.input_field.setPlaceholderText("Type a message...")
         self.input_field.setMaximumHeight(100)
-        self.input_field.setStyleSheet("""
-            QTextEdit {
-                border: 1px solid #ccc;
-                border-radius: 20px;
-                padding: 10px;
-                background-color: white;
-            }
-        """)
+        self.input_field.setObjectName("input_field")
 
-        send_button = QPushButton()
-        send_button.setIcon(QIcon(resource_path(os.path.join("public", "icons", "send.png"))))
-        send_button.setFixedSize(40, 40)
-        send_button.setStyleSheet("""
+        self.send_button = QPushButton()
+        self.send_button.setIcon(load_icon(os.path.join("public", "icons", "send.png")))
+        self.send_button.setFixedSize(40, 40)
+        self.send_button.setStyleSheet("""
             QPushButton {
                 border: none;
                 border-radius: 20px;
@@ -482,41 +864,60 @@ class ChatbotWindow(QMainWindow):
                 background-color: #075E54;
             }
         """)
-        send_button.clicked.connect(self.send_message)
+        self.send_button.clicked.connect(self.send_message)
+
+        # Collapse rapid send activations into a single request
+        self._send_debounce = QTimer(self)
+        self._send_debounce.setSingleShot(True)
+        self._send_debounce.setInterval(250)
+        self._send_debounce.timeout.connect(self._do_send)
+
+        # Streamed tokens are applied to the reply bubble in 50 ms batches
+        self._pending_chunks = []
+        self._chunk_timer = QTimer(self)
+        self._chunk_timer.setSingleShot(True)
+        self._chunk_timer.setInterval(50)
+        self._chunk_timer.timeout.connect(self.flush_api_chunks)
+
+        # Set while an API request is running (see send_message)
+        self._inflight = False
+
+        # Collapse bursts of additions/updates into a single scroll per frame
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(16)
+        self._scroll_timer.timeout.connect(self.scroll_to_bottom)
 
         input_layout.addWidget(self.input_field)
-        input_layout.addWidget(send_button)
+        input_layout.addWidget(self.send_button)
 
         # Add components to main layout
-        layout.addWidget(self.scroll_area)
+        layout.addWidget(self.chat_view)
         layout.addWidget(input_container)
 
         # Initialize theme
-        self.toggle_theme()
-
-        # Initialize conversation history with system message
-        self.conversation_history.append(
-            {"role": "system", "content": self.get_personality_prompt()}
-        )
+        self.apply_theme()
 
-        # Add messages to chat
-        for msg in reversed(self.conversation_history):
-            self.add_message(msg["content"], msg["role"] == "user")
+        self.add_message(self.conversation_history[0]["content"], is_user=False)
 
         # Initialize loading indicator
         self.loading_indicator = None
-
-        self.apply_theme()
+        self._streaming = False
 
         self.show()
 
-    def apply_theme(self):
-        """Apply the current theme (light/dark) to the window."""
-        is_dark = self.property("darkTheme")
+        # Read the stored key and saved history without holding up the first paint
+        self.load_history()
+        self.load_api_key()
 
-        # Create palette for the theme
-        palette = QPalette()
+    @staticmethod
+    def _build_palette(is_dark: bool) -> QPalette:
+        """Return the application palette for a theme, built once per theme."""
+        palette = _PALETTES.get(is_dark)
+        if palette is not None:
+            return palette
 
+        palette = QPalette()
         if is_dark:
             # Dark theme colors
             palette.setColor(QPalette.Window, QColor(53, 53, 53))
@@ -546,164 +947,96 @@ class ChatbotWindow(QMainWindow):
             palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
             palette.setColor(QPalette.HighlightedText, Qt.white)
 
+        _PALETTES[is_dark] = palette
+        return palette
+
+    def apply_theme(self):
+        """Apply the current theme (light/dark) to the window."""
+        is_dark = bool(self.property("darkTheme"))
+
+        # Update theme toggle button text
+        self.theme_toggle.setText("🌙" if is_dark else "☀️")
+
         # Apply palette to both the window and application
+        palette = self._build_palette(is_dark)
         self.setPalette(palette)
         QApplication.instance().setPalette(palette)
 
-        # Update input field style
-        self.input_field.setStyleSheet(f"""
-            QTextEdit {{
-                border: 1px solid {"#666" if is_dark else "#ccc"};
-                border-radius: 20px;
-                padding: 10px;
-                background-color: {QColor(53, 53, 53).name() if is_dark else "white"};
-                color: {"white" if is_dark else "black"};
-            }}
-        """)
-
-        # Update scroll area style
-        self.scroll_area.setStyleSheet(f"""
-            QScrollArea {{
-                border: none;
-                background-color: {"#2c2c2c" if is_dark else "transparent"};
-            }}
-            QScrollBar:vertical {{
-                border: none;
-                background-color: {"#404040" if is_dark else "#f0f0f0"};
-                width: 10px;
-                margin: 0px;
-            }}
-            QScrollBar::handle:vertical {{
-                background-color: {"#666" if is_dark else "#c1c1c1"};
-                min-height: 30px;
-                border-radius: 5px;
-            }}
-            QScrollBar::handle:vertical:hover {{
-                background-color: {"#808080" if is_dark else "#a8a8a8"};
-            }}
-        """)
+        # Input field and chat view styles follow the darkTheme property
+        self.repolish_themed_widgets()
 
-    def update_theme_icon(self):
-        is_dark = self.property("darkTheme")
-        icon_name = "light.png" if is_dark else "dark.png"
-        icon_path = os.path.join("icons", icon_name)
-        self.theme_button.setIcon(QIcon(icon_path))
+        # Update message bubbles
+        self.chat_delegate.dark = is_dark
+        self.chat_view.viewport().update()
+
+    def repolish_themed_widgets(self):
+        # Qt does not restyle descendants when an ancestor's property changes,
+        # so re-polish just the widgets whose rules depend on darkTheme
+        for widget in (
+            self.input_field,
+            self.chat_view,
+            self.chat_view.verticalScrollBar(),
+        ):
+            widget.style().unpolish(widget)
+            widget.style().polish(widget)
 
     def toggle_theme(self):
         """Toggle between light and dark theme"""
-        is_dark = not self.property("darkTheme")
-        self.setProperty("darkTheme", is_dark)
-
-        # Update theme toggle button text
-        self.theme_toggle.setText("🌙" if is_dark else "☀️")
-
-        # Update application style
-        app = QApplication.instance()
-        palette = QPalette()
-
-        if is_dark:
-            # Dark theme colors
-            palette.setColor(QPalette.Window, QColor(53, 53, 53))
-            palette.setColor(QPalette.WindowText, Qt.white)
-            palette.setColor(QPalette.Base, QColor(25, 25, 25))
-            palette.setColor(QPalette.AlternateBase, QColor(53, 53, 53))
-            palette.setColor(QPalette.ToolTipBase, Qt.white)
-            palette.setColor(QPalette.ToolTipText, Qt.white)
-            palette.setColor(QPalette.Text, Qt.white)
-            palette.setColor(QPalette.Button, QColor(53, 53, 53))
-            palette.setColor(QPalette.ButtonText, Qt.white)
-            palette.setColor(QPalette.Link, QColor(42, 130, 218))
-            palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-            palette.setColor(QPalette.HighlightedText, Qt.white)
+        self.setProperty("darkTheme", not self.property("darkTheme"))
+        self.apply_theme()
 
-            # Dark theme input field
-            self.input_field.setStyleSheet("""
-                QTextEdit {
-                    border: 1px solid #666;
-                    border-radius: 20px;
-                    padding: 10px;
-                    background-color: #383838;
-                    color: white;
-                }
-            """)
+    def load_api_key(self):
+        """Read the stored API key on a worker thread."""
+        self.key_loader = KeyLoader()
+        self.key_loader.loaded.connect(self.handle_api_key_loaded)
+        self.key_loader.start()
+
+    def handle_api_key_loaded(self, key):
+        if key:
+            self.api_key = key
+            # Validate the key before the user sends anything
+            self.check_api_key()
         else:
-            # Light theme colors
-            palette.setColor(QPalette.Window, Qt.white)
-            palette.setColor(QPalette.WindowText, Qt.black)
-            palette.setColor(QPalette.Base, QColor(255, 255, 255))
-            palette.setColor(QPalette.AlternateBase, QColor(245, 245, 245))
-            palette.setColor(QPalette.ToolTipBase, Qt.white)
-            palette.setColor(QPalette.ToolTipText, Qt.black)
-            palette.setColor(QPalette.Text, Qt.black)
-            palette.setColor(QPalette.Button, QColor(240, 240, 240))
-            palette.setColor(QPalette.ButtonText, Qt.black)
-            palette.setColor(QPalette.Link, QColor(0, 0, 255))
-            palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-            palette.setColor(QPalette.HighlightedText, Qt.white)
-
-            # Light theme input field
-            self.input_field.setStyleSheet("""
-                QTextEdit {
-                    border: 1px solid #ccc;
-                    border-radius: 20px;
-                    padding: 10px;
-                    background-color: white;
-                    color: black;
-                }
-            """)
-
-        app.setPalette(palette)
-
-        # Update scroll area style
-        self.scroll_area.setStyleSheet("""
-            QScrollArea {
-                border: none;
-                background-color: transparent;
-            }
-            QScrollBar:vertical {
-                border: none;
-                background-color: #f0f0f0;
-                width: 10px;
-                margin: 0px;
-            }
-            QScrollBar::handle:vertical {
-                background-color: #c1c1c1;
-                min-height: 30px;
-                border-radius: 5px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #a8a8a8;
-            }
-        """)
-
-        # Update message bubbles
-        for i in range(self.chat_layout.count()):
-            widget = self.chat_layout.itemAt(i).widget()
-            if isinstance(widget, MessageBubble) and widget.bubble:
-                is_user = widget.property("is_user")
-                user_bg = "#128C7E" if is_dark else "#DCF8C6"
-                user_text = "#FFFFFF" if is_dark else "#000000"
-                bot_bg = "#383838" if is_dark else "#FFFFFF"
-                bot_text = "#FFFFFF" if is_dark else "#000000"
-
-                widget.bubble.setStyleSheet(f"""
-                    QTextEdit {{
-                        background-color: {user_bg if is_user else bot_bg};
-                        color: {user_text if is_user else bot_text};
-                        border-radius: 15px;
-                        padding: 8px;
-                        border: none;
-                    }}
-                """)
+            self.request_api_key()
+        self.send_button.setEnabled(self._history_loaded and bool(self.api_key))
+
+    def load_history(self):
+        """Open the database and read recent history on a worker thread."""
+        # Settings would reset the conversation the loaded rows belong to
+        self.send_button.setEnabled(False)
+        self.settings_button.setEnabled(False)
+        self.history_loader = HistoryLoader(self.context_window)
+        self.history_loader.loaded.connect(self.handle_history_loaded)
+        self.history_loader.start()
+
+    def handle_history_loaded(self, db_manager, recent_rows):
+        self.db_manager = db_manager
+        self._history_loaded = True
+        self.send_button.setEnabled(bool(self.api_key))
+        self.settings_button.setEnabled(True)
+
+        recent_rows.reverse()
+        recent_messages = [
+            {"role": role, "content": content} for role, content, _ in recent_rows
+        ]
+        self.conversation_history.extend(recent_messages)
+        self.message_cache.extend(recent_messages)
+
+        # Add messages to chat in one insertion, with a single layout and scroll.
+        # Stored messages keep the time they were sent.
+        timestamp = ChatModel.current_timestamp()
+        self.chat_model.append_messages(
+            [
+                (content, role == "user", sent_at or timestamp)
+                for role, content, sent_at in recent_rows
+            ]
+        )
+        self.schedule_scroll_to_bottom()
 
     def get_personality_prompt(self) -> str:
-        prompts = {
-            "Professional": "You are a professional assistant. Provide clear, concise, and accurate responses in a formal tone.",
-            "Friendly": "You are a friendly and approachable assistant. Use a casual, warm tone and engage in natural conversation.",
-            "Technical": "You are a technical expert. Provide detailed technical explanations and use industry-standard terminology.",
-            "Creative": "You are a creative assistant. Think outside the box and provide innovative solutions with an imaginative flair.",
-        }
-        return prompts.get(self.personality, prompts["Professional"])
+        return _PERSONALITY_PROMPTS.get(
+            self.personality, _PERSONALITY_PROMPTS["Professional"]
+        )
 
     def show_settings(self):
         dialog = ChatSettings(self)
@@ -731,40 +1064,70 @@ class ChatbotWindow(QMainWindow):
                 self.conversation_history = [
                     {"role": "system", "content": self.get_personality_prompt()}
                 ]
-                self.message_cache = []
+                self.message_cache = deque(maxlen=new_context)
 
                 # Add system message to chat
                 self.add_message("Settings updated. Starting new conversation.", False)
 
     def add_message(self, message, is_user=True, image_path=None):
-        bubble = MessageBubble(message, is_user, image_path=image_path)
-        self.chat_layout.addWidget(bubble)
+        pixmap = None
+        if image_path:
+            # Reuse the decoded, scaled image when the same file is shown again
+            key = f"bubble:{image_path}"
+            pixmap = QPixmapCache.find(key)
+            if pixmap is None:
+                pixmap = QPixmap(image_path).scaled(
+                    300, 300, Qt.KeepAspectRatio, Qt.SmoothTransformation
+                )
+                QPixmapCache.insert(key, pixmap)
+        index = self.chat_model.append_message(
+            message, is_user, ChatModel.current_timestamp(), pixmap
+        )
         # Scroll to bottom after adding message
-        QTimer.singleShot(100, self.scroll_to_bottom)
+        self.schedule_scroll_to_bottom()
+        return index
 
-    def scroll_to_bottom(self):
-        self.scroll_area.verticalScrollBar().setValue(
-            self.scroll_area.verticalScrollBar().maximum()
-        )
+    def set_message_text(self, index, text):
+        self.chat_model.set_message_text(index.row(), text)
+        # The bubble may have grown, so its row needs to be laid out again
+        self.chat_delegate.sizeHintChanged.emit(QModelIndex(index))
+
+    def show_message_menu(self, pos):
+        index = self.chat_view.indexAt(pos)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        copy_action = menu.addAction("Copy")
+        if menu.exec_(self.chat_view.viewport().mapToGlobal(pos)) == copy_action:
+            QApplication.clipboard().setText(index.data(Qt.DisplayRole))
 
-    def resizeEvent(self, event: QResizeEvent):
-        super().resizeEvent(event)
-        # Update all message bubbles when window is resized
-        for i in range(self.chat_layout.count()):
-            widget = self.chat_layout.itemAt(i).widget()
-            if isinstance(widget, MessageBubble):
-                # Update the maximum width of the bubble
-                if widget.bubble:
-                    widget.bubble.setMaximumWidth(int(self.width() * 0.7))
-                    widget.bubble.document().adjustSize()
-                    widget.adjustSize()
+    def schedule_scroll_to_bottom(self):
+        if not self._scroll_timer.isActive():
+            self._scroll_timer.start()
+
+    def scroll_to_bottom(self):
+        self.chat_view.scrollToBottom()
 
     def request_api_key(self):
+        # Hold a queued send while the dialog's event loop runs, so it doesn't
+        # go out with the rejected key and prompt a second time
+        resume_send = self._send_debounce.isActive()
+        self._send_debounce.stop()
+        self._prompting_key = True
+        try:
+            self._ask_for_api_key()
+        finally:
+            self._prompting_key = False
+            if resume_send:
+                self._send_debounce.start()
+
+    def _ask_for_api_key(self):
         dialog = QInputDialog()
         dialog.setWindowTitle("API Key Required")
         dialog.setLabelText(
             "Please enter your OpenRouter API key:\n"
-            "The key will be stored securely at ~/.chatbotqt/api_key.cache\n"
+            "The key will be stored in your system keychain when available,\n"
+            "otherwise at ~/.chatbotqt/api_key.cache\n"
             "Get your API key from: https://openrouter.ai/keys"
         )
         dialog.setTextEchoMode(QLineEdit.Password)
@@ -774,19 +1137,40 @@ class ChatbotWindow(QMainWindow):
             if key:
                 if APIKeyManager.save_key(key):
                     self.api_key = key
+                    # Keep the shared session's header in step with the new key
+                    if self._http is not None:
+                        self._http.headers["Authorization"] = f"Bearer {key}"
                 else:
                     self.add_message("Error: Invalid API key format", False)
-                    self.request_api_key()  # Try again
+                    self._ask_for_api_key()  # Try again
             else:
                 sys.exit()
         else:
             sys.exit()
 
     def send_message(self):
+        # Drop activations while a reply is still pending, while history or the
+        # API key is still loading, or while the key dialog is open
+        if (
+            self._inflight
+            or not self._history_loaded
+            or not self.api_key
+            or self._prompting_key
+        ):
+            return
+        self._send_debounce.start()
+
+    def _do_send(self):
         user_message = self.input_field.toPlainText().strip()
         if not user_message:
             return
 
+        # Block further sends, and settings changes that would reset the
+        # conversation the reply belongs to, until the reply (or error) comes back
+        self._inflight = True
+        self.send_button.setEnabled(False)
+        self.settings_button.setEnabled(False)
+
         self.add_message(user_message, True)
         self.input_field.clear()
 
@@ -794,53 +1178,155 @@ class ChatbotWindow(QMainWindow):
         model_name = self.model.split(" (Free)")[0]
 
         # Show loading indicator
-        loading_message = MessageBubble("...", False)
-        self.chat_layout.addWidget(loading_message)
-        self.loading_indicator = loading_message
-        self.scroll_to_bottom()
+        index = self.chat_model.append_message(
+            "...", False, ChatModel.current_timestamp()
+        )
+        self.loading_indicator = QPersistentModelIndex(index)
+        self.schedule_scroll_to_bottom()
 
         # Save user message to database
-        self.db_manager.save_message("user", user_message)
+        if self.db_manager is not None:
+            self.db_manager.save_message("user", user_message)
 
         # Update message cache
         self.message_cache.append({"role": "user", "content": user_message})
-        if len(self.message_cache) > self.context_window:
-            self.message_cache.pop(0)
 
-        # Create and start API worker thread
-        self.worker = ApiWorker(self.api_key, model_name, self.message_cache)
+        self.start_api_worker(model_name)
+
+    def build_request_messages(self):
+        """Return the system prompt plus as much recent context as fits the budget."""
+        system_message = self.conversation_history[0]
+        messages = list(self.message_cache)
+
+        # Estimate ~4 characters per token and drop the oldest messages first,
+        # always keeping the message being answered
+        budget = self.max_context_tokens * 4 - len(system_message["content"])
+        total = sum(len(msg["content"]) for msg in messages)
+        while len(messages) > 1 and total > budget:
+            total -= len(messages.pop(0)["content"])
+
+        return [system_message] + messages
+
+    def get_http_session(self):
+        """Return the shared HTTP session, importing requests on first use."""
+        if self._http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            # One session so follow-up messages reuse the open TLS connection
+            self._http = requests.Session()
+            self._http.mount(
+                "https://", HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            )
+            self._http.headers.update(
+                {
+                    "Authorization": f"Bearer {self.api_key}",
+                    "HTTP-Referer": "https://github.com/Mustaffa96/ChatbotQT",
+                    "X-Title": "ChatbotQT",
+                    "Content-Type": "application/json",
+                }
+            )
+        return self._http
+
+    def start_api_worker(self, model_name):
+        """Create and start the API worker thread for the current message cache."""
+        self._streaming = False
+        self.worker = ApiWorker(
+            model_name,
+            self.build_request_messages(),
+            self.get_http_session(),
+        )
+        self.worker.chunk_received.connect(self.handle_api_chunk)
         self.worker.finished.connect(self.handle_api_response)
         self.worker.error.connect(self.handle_api_error)
+        self.worker.unauthorized.connect(self.handle_api_unauthorized)
         self.worker.start()
 
-    def handle_api_response(self, response_json):
-        # Remove loading indicator
-        if self.loading_indicator:
-            self.chat_layout.removeWidget(self.loading_indicator)
-            self.loading_indicator.deleteLater()
-            self.loading_indicator = None
+    def check_api_key(self):
+        self.key_check_worker = KeyCheckWorker(self.api_key)
+        self.key_check_worker.invalid.connect(self.handle_invalid_api_key)
+        self.key_check_worker.start()
+
+    def handle_invalid_api_key(self):
+        # A send in flight with the same key gets its own 401 and re-prompts,
+        # and a key entered since the check started needs no replacing
+        if (
+            self._inflight
+            or self._prompting_key
+            or self.api_key != self.key_check_worker.api_key
+        ):
+            return
+        APIKeyManager.clear_key()
+        self.request_api_key()
+
+    def handle_api_unauthorized(self):
+        # The cached key was rejected; ask for a new one and replay the request
+        self.worker.wait()
+        APIKeyManager.clear_key()
+        self.request_api_key()
+        self.start_api_worker(self.worker.model)
+
+    def replace_loading_indicator(self, text):
+        """Rebind the loading bubble's row to text instead of swapping rows."""
+        loading = self.loading_indicator
+        self.loading_indicator = None
+        if loading and loading.isValid():
+            self.set_message_text(loading, text)
+        else:
+            self.add_message(text, False)
 
-        bot_response = response_json["choices"][0]["message"]["content"]
+    def handle_api_chunk(self, delta):
+        # Buffer tokens so the bubble is re-laid out at most once per flush
+        self._pending_chunks.append(delta)
+        if not self._chunk_timer.isActive():
+            self._chunk_timer.start()
+
+    def flush_api_chunks(self):
+        delta = "".join(self._pending_chunks)
+        self._pending_chunks.clear()
+
+        # The loading bubble becomes the reply bubble on the first token
+        loading = self.loading_indicator
+        if not delta or not (loading and loading.isValid()):
+            return
+        if self._streaming:
+            text = loading.data(Qt.DisplayRole) + delta
+        else:
+            self._streaming = True
+            text = delta
+        self.set_message_text(loading, text)
+        self.schedule_scroll_to_bottom()
+
+    def stop_streaming(self):
+        # The final text (or error) supersedes any tokens still buffered
+        self._chunk_timer.stop()
+        self._pending_chunks.clear()
+        self._streaming = False
+
+    def handle_api_response(self, bot_response):
+        self._inflight = False
+        self.send_button.setEnabled(True)
+        self.settings_button.setEnabled(True)
+        self.stop_streaming()
+
+        # The (possibly streamed) bubble ends up holding the full text
+        self.replace_loading_indicator(bot_response)
 
         # Save bot response to database
-        self.db_manager.save_message("assistant", bot_response)
+        if self.db_manager is not None:
+            self.db_manager.save_message("assistant", bot_response)
 
         # Update message cache
         self.message_cache.append({"role": "assistant", "content": bot_response})
-        if len(self.message_cache) > self.context_window:
-            self.message_cache.pop(0)
-
-        self.add_message(bot_response, False)
 
     def handle_api_error(self, error_message):
-        # Remove loading indicator
-        if self.loading_indicator:
-            self.chat_layout.removeWidget(self.loading_indicator)
-            self.loading_indicator.deleteLater()
-            self.loading_indicator = None
-
-        self.add_message(
-            f"Error: Could not get response from API. {error_message}", False
+        self._inflight = False
+        self.send_button.setEnabled(True)
+        self.settings_button.setEnabled(True)
+        self.stop_streaming()
+
+        self.replace_loading_indicator(
+            f"Error: Could not get response from API. {error_message}"
         )
 
 
@@ -854,7 +1340,25 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+@lru_cache(maxsize=8)
+def load_icon(relative_path):
+    """Load an icon from the app resources, decoding each file only once."""
+    return QIcon(resource_path(relative_path))
+
+
+def load_env_file():
+    """Apply a .env file from the working directory, if there is one."""
+    if os.path.exists(".env"):
+        from dotenv import load_dotenv
+
+        load_dotenv(".env")
+
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    # Environment overrides (e.g. proxy settings read by requests) are not needed
+    # to show the window; apply them once the event loop is running, ahead of
+    # the startup key check
+    QTimer.singleShot(0, load_env_file)
     window = ChatbotWindow()
     sys.exit(app.exec_())